@@ -8,13 +8,41 @@ Comes with:
 
 import argparse
 import os
+import tempfile
 import pandas as pd
 import numpy as np
+import matplotlib
+matplotlib.use("Agg")  # We only use matplotlib for its colourmaps, so there's no need for a GUI backend
 import matplotlib.pyplot as plt
 from wordcloud import WordCloud, ImageColorGenerator
 from PIL import Image
 import re
 from pathlib import Path
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+
+#############################
+# Regex Patterns
+#############################
+
+# Compiled once here, rather than on every call / every word
+
+# A word we're happy to put in a WordCloud
+_RE_ALPHANUM = re.compile("^[A-Z0-9]+$")
+
+# The same, but finds every such whitespace-delimited word in a block of text in one pass
+_RE_WORD = re.compile(r"(?<!\S)[A-Z0-9]+(?!\S)")
+
+# CSV column detection
+_RE_TIMESTAMP = re.compile("^[0-9TZ:. -+]{4,25}$")
+_RE_NAME = re.compile("^[A-Za-z0-9 -]{1,30}$")
+
+# A new line in a WhatsApp export. Groups are (Person, Message)
+_RE_WHATSAPP_LINE = re.compile("^[0-9]{2}/[0-9]{2}/[0-9]{4}, [0-9]{2}:[0-9]{2} - ([A-Za-z0-9 -]{1,30}): (.+)$")
+
+# Available matplotlib colourmaps. plt.colormaps() builds a new list on every call
+_COLORMAPS = frozenset(plt.colormaps())
 
 
 #############################
@@ -102,6 +130,43 @@ def v_print(*args, **kwargs):
 		print(*args, **kwargs)
 
 
+# The mask and colour are the same for every WordCloud, so each worker process is sent them once, by _init_cloud_worker
+_cloud_mask_array = None
+_cloud_colour = None
+
+
+def _init_cloud_worker(mask_array, colour):
+	"""
+	Sets up the mask and colour that _generate_cloud_from_list will use in this process
+	"""
+	global _cloud_mask_array, _cloud_colour
+	_cloud_mask_array = mask_array
+	_cloud_colour = colour
+
+
+def _generate_cloud_from_list(word_list, output_file):
+	"""
+	Generates a WordCloud from a word_list, and saves it to output_file
+	This lives outside of WordCloudGenerator so that it can be sent to worker processes
+	_init_cloud_worker must have been called in this process first
+	"""
+	mask_array = _cloud_mask_array
+	colour = _cloud_colour
+
+	# WordCloud renders with Pillow, so we can save its image directly rather than re-rasterising it through matplotlib
+	if colour == "infer":
+		custom_colours = ImageColorGenerator(mask_array)
+		cloud = WordCloud(max_words=2000, mask=mask_array).fit_words(word_list)
+		cloud = cloud.recolor(color_func=custom_colours)
+	else:
+		cloud = WordCloud(max_words=2000, mask=mask_array, colormap=colour)
+		cloud.fit_words(word_list)
+	
+	cloud.to_image().save(output_file, optimize=False)
+	
+	return True
+
+
 #############################
 # Main Class
 #############################
@@ -130,6 +195,8 @@ class WordCloudGenerator:
 		self.mask = self._find_file(cmd_options.mask)
 		self.colour = cmd_options.colour
 		self.illegal_chars = cmd_options.ignore
+		# Whitespace is left alone, as it's what separates the words
+		self._strip_tbl = str.maketrans('', '', ''.join(c for c in self.illegal_chars if not c.isspace()))
 		self.output = Path(cmd_options.output) if cmd_options.output else self.script_dir / "wcg_output/"
 
 		# Run checks
@@ -171,7 +238,14 @@ class WordCloudGenerator:
 		
 		if self.file_type == "csv":
 			v_print("Reading in file as a CSV")
-			self.file_data = pd.read_csv(self.input_file)
+			try:
+				# Arrow's multithreaded parser is much quicker on large files
+				self.file_data = pd.read_csv(self.input_file, engine="pyarrow")
+			except (ImportError, ValueError):
+				# Fall back to the default parser if pyarrow isn't installed, this pandas doesn't know the engine,
+				# or Arrow can't parse the file (e.g. multi-line quoted messages). ArrowInvalid is a ValueError
+				v_print("Unable to read the CSV with pyarrow, falling back to the default parser")
+				self.file_data = pd.read_csv(self.input_file)
 			rows, columns = self.file_data.shape
 			v_print(f"This CSV has {rows} row(s) and {columns} column(s)")
 
@@ -181,9 +255,8 @@ class WordCloudGenerator:
 				raise Exception("CSV appears to have no rows. WordCloudGenerator cannot parse this file")
 		
 		elif self.file_type == "whatsapp":
+			# WhatsApp exports can be huge, so these are streamed line by line in _parse_whatsapp
 			v_print("Reading in file as a Whatsapp export")
-			self.file_data = [line.rstrip('\n') for line in open(self.input_file, encoding="utf8")]
-			v_print(f"This WhatsApp export has {len(self.file_data)} line(s) of data in it")
 	  
 		else:
 			raise Exception("Specified file is of unknown type")
@@ -192,15 +265,64 @@ class WordCloudGenerator:
 		return True
 
 	def _check_mask(self):
+		# Decoded masks are cached alongside the image, so repeat runs with the same mask can skip decoding it
+		cache_path = self.mask.with_name(self.mask.name + ".npy")
+		self.mask_array = self._load_cached_mask(cache_path)
+		if self.mask_array is not None:
+			return
+
 		try:
-			self.mask_array = np.array(Image.open(self.mask))
+			# np.asarray wraps the decoded image, rather than taking a second copy like np.array
+			with Image.open(self.mask) as mask_image:
+				mask_image.load()
+				self.mask_array = np.asarray(mask_image)
 		except:
 			raise Exception(f"Unable to parse the provided mask ({self.mask}) into a numpy array")
 
+		self._save_cached_mask(cache_path)
+
+	def _load_cached_mask(self, cache_path):
+		"""
+		Returns the cached mask array (memory-mapped), or None if there isn't a usable cache for self.mask
+		The cache is stamped with the modification time of the mask it was made from, and must still match it
+		"""
+		if not cache_path.is_file():
+			return None
+
+		try:
+			if cache_path.stat().st_mtime_ns != self.mask.stat().st_mtime_ns:
+				v_print(f"Cached mask {cache_path} is out of date")
+				return None
+			v_print(f"Loading cached mask from {cache_path}")
+			return np.load(cache_path, mmap_mode="r")
+		except Exception:
+			# A truncated or otherwise unreadable cache just means we decode the image again
+			v_print(f"Unable to read cached mask {cache_path}")
+			return None
+
+	def _save_cached_mask(self, cache_path):
+		"""
+		Caches self.mask_array next to the mask, stamped with the mask's modification time
+		This is written to a temporary file and moved into place, so an interrupted run can't leave a broken cache
+		"""
+		temp_path = None
+		try:
+			with tempfile.NamedTemporaryFile(dir=cache_path.parent, prefix=cache_path.name, suffix=".tmp", delete=False) as temp_file:
+				temp_path = temp_file.name
+				np.save(temp_file, self.mask_array)
+			mask_stat = self.mask.stat()
+			os.utime(temp_path, ns=(mask_stat.st_atime_ns, mask_stat.st_mtime_ns))
+			os.replace(temp_path, cache_path)
+		except OSError:
+			# Not being able to write the cache (e.g. a read-only directory) isn't a problem
+			v_print(f"Unable to cache the mask to {cache_path}")
+			if temp_path and os.path.exists(temp_path):
+				os.remove(temp_path)
+
 	def _check_colour(self):
 		if self.colour == "infer":
 			pass
-		elif self.colour not in plt.colormaps():
+		elif self.colour not in _COLORMAPS:
 			raise Exception(f"The colourmap provided ({self.colour}) does not exist")
 	
 	def _parse_csv(self):
@@ -215,17 +337,17 @@ class WordCloudGenerator:
 		- There will be fewer than 256 people (seriously, why would a group have more than that), and their name will follow a regex pattern (below)
 		- Timestamps are going to follow a specific regex pattern (below)
 		- The other column will be the messages
+		Only the first few rows of each column are checked against the regex patterns, as that's plenty to tell them apart
 		"""
 		print("Parsing data from CSV...")
 
-		re_timestamp = re.compile("^[0-9TZ:. -+]{4,25}$")
-		re_name = re.compile("^[A-Za-z0-9 -]{1,30}$")
-
 		# We're going to iterate over the df (csv) and try to figure out which column is which
 		
+		sample_rows = 200
 		name_col = None
 		time_col = None
 		message_col = None
+		names = list()
 
 		v_print()
 		v_print("Parsing columns to determine what is what...")
@@ -233,34 +355,38 @@ class WordCloudGenerator:
 		for col in col_list:
 			v_print(f"\tChecking column '{col}'")
 
+			column = self.file_data[col].head(sample_rows).astype(str)
+
 			# Check for timestamp
 			if not time_col:
 				v_print(f"\t\tTimestamps?", end='')
-				for index, row in self.file_data.iterrows():
-					if not re_timestamp.match(row[col]):
-						v_print(f" ==> No - Column '{col}' doesn't appear to be a timestamp. Failed on row {index}")
-						break
-					if index == len(self.file_data) - 1:
-						v_print(f" ==> Yes! - Column '{col}' appears to be a timestamp")
-						time_col = col
-				if time_col:
+				matches = column.str.match(_RE_TIMESTAMP)
+				if matches.all():
+					v_print(f" ==> Yes! - Column '{col}' appears to be a timestamp")
+					time_col = col
 					continue
+				v_print(f" ==> No - Column '{col}' doesn't appear to be a timestamp. Failed on row {matches.idxmin()}")
 			
 			# Check for names
 			if not name_col:
-				v_print(f"\t\tNames?", end='')	  
-				for index, row in self.file_data.iterrows():
-					if not re_name.match(row[col]):
-						v_print(f" ==> No - Column '{col}' doesn't appear to contain names. Failed on row {index}")
-						break
-					if index == len(self.file_data) - 1:
-						if len(self.file_data[col].unique()) > 255:
-							v_print(f" ==> No - Column '{col}' has too many unique values ({len(self.file_data[col].unique())})")
+				v_print(f"\t\tNames?", end='')
+				matches = column.str.match(_RE_NAME)
+				if not matches.all():
+					v_print(f" ==> No - Column '{col}' doesn't appear to contain names. Failed on row {matches.idxmin()}")
+				else:
+					# Only scan the column for unique values once. Rows without a name are ignored
+					unique_values = self.file_data[col].dropna().unique()
+					if len(unique_values) > 255:
+						v_print(f" ==> No - Column '{col}' has too many unique values ({len(unique_values)})")
+					else:
+						invalid_name = self._find_invalid_name(unique_values)
+						if invalid_name is not None:
+							v_print(f" ==> No - Column '{col}' doesn't appear to contain names. '{invalid_name}' isn't a valid name")
 						else:
-							v_print(f" ==> Yes! - Column '{col}' appears to contain {len(self.file_data[col].unique())} name(s).")
+							v_print(f" ==> Yes! - Column '{col}' appears to contain {len(unique_values)} name(s).")
 							name_col = col
-				if name_col:
-					continue
+							names = list(unique_values)
+							continue
 			
 			# Assume the one left is the message column
 			if not message_col:
@@ -270,16 +396,26 @@ class WordCloudGenerator:
 		v_print()
 		# For each name, we're going to create a word list in the self.word_data
 
-		names = list(self.file_data[name_col].unique())
 		print("Parsing data for each of the following people:")
 
 		for name in names:
 			print(f"\t {name}", end='')
-			self.word_data[name] = self._extract_words(self.file_data.loc[self.file_data[name_col] == name][message_col])
+			self.word_data[name] = self._extract_words_series(self.file_data.loc[self.file_data[name_col] == name][message_col])
 
 			print(f" -> {len(self.word_data[name])} words extracted") 
 
 
+	def _find_invalid_name(self, names):
+		"""
+		Returns the first of the provided names that doesn't match the name regex, or None if they're all fine
+		Only a sample of the column is checked when working out which column is which, but the names end up in
+		the output filenames, so every one of them needs checking before a column is accepted
+		"""
+		invalid = ~pd.Series(names).astype(str).str.fullmatch(_RE_NAME)
+		if invalid.any():
+			return names[invalid.idxmax()]
+		return None
+
 	def _parse_whatsapp(self):
 		"""
 		Parse self.input file as a WhatsApp export file
@@ -293,75 +429,50 @@ class WordCloudGenerator:
 		
 		print("Parsing data from WhatsApp Export...")
 
-		# Regex to parse a newline. Groups are (Person, Message)
-		re_new_line = re.compile("^[0-9]{2}/[0-9]{2}/[0-9]{4}, [0-9]{2}:[0-9]{2} - ([A-Za-z0-9 -]{1,30}): (.+)$")
-		person_data = dict()
+		person_data = defaultdict(Counter)
+		find_words = _RE_WORD.findall
+		strip_tbl = self._strip_tbl
 
 		# We have to do weird stuff with WhatsApp data
-		# If a line conforms to the regex above, we can parse the person out, and append the line to their list
-		# If not, we need to remember who spoke last, and append the line to theirs
+		# If a line conforms to the regex above, we can parse the person out, and count the words against them
+		# If not, we need to remember who spoke last, and count the words against them instead
 
-		for line in self.file_data:
-			regex_match = re_new_line.search(line)
+		with open(self.input_file, encoding="utf8", buffering=1<<20) as whatsapp_file:
+			for line in whatsapp_file:
+				line = line.rstrip('\n')
+				regex_match = _RE_WHATSAPP_LINE.match(line)
 
-			try:
-				# See if we hit the regex
-				regex_match.string
-			except AttributeError:
-				# Case -> Regex doesn't hit - Line Continuation
-				message = line
-			else:
-				# Case -> Regex hits - New Line
-				reg_captures = re_new_line.match(line)
-				person = reg_captures.group(1)
-				message = reg_captures.group(2)
+				if regex_match is None:
+					# Case -> Regex doesn't hit - Line Continuation
+					message = line
+				else:
+					# Case -> Regex hits - New Line
+					person = regex_match.group(1)
+					message = regex_match.group(2)
 
-			# Now we have the person and message string, we can add these to the person_data dict
+				# Now we have the person and message string, we can count the words into the person_data dict
+				# Upper-case and strip the message, then split out the alphanumeric words in a single regex pass
+				# Counting as we go means we never hold the messages themselves in memory
 
-			try:
-				person_data[person].append(message)
-			except KeyError:
-				person_data[person] = [message]
+				person_data[person].update(find_words(message.upper().translate(strip_tbl)))
 		
 		print("Parsing data for the following people:")
 
-		for name, message_list in person_data.items():
+		for name, word_freq in person_data.items():
 			print(f"\t {name}", end='')
-			self.word_data[name] = self._extract_words(message_list)
+			self.word_data[name] = word_freq
 			print(f" -> {len(self.word_data[name])} words extracted")
 		
 
 
-	def _extract_words(self, message_list):
+	def _extract_words_series(self, messages):
 		"""
-		Returns a dict of word frequency from the provided list of messages
+		Returns a dict of word frequency from the provided pandas Series of messages
+		Words are extracted the same way as in _parse_whatsapp, but with pandas' vectorised string methods
 		"""
-		unparsed_word_list = list()
-
-		# Extract all of the words
-
-		for message in message_list:
-			unparsed_word_list.extend(message.split())
-
-		# Parse the unparsed list
-		word_freq = dict()
-		
-		for word in unparsed_word_list:
-			word = word.upper()
-
-			# Throw away illegal characters
-			for char in self.illegal_chars:
-				word = word.replace(char, '')
-			
-			# Use this word if it's an alphanumeric word
-			re_alphanumeric = re.compile("^[A-Z0-9]+$")
-			if re_alphanumeric.match(word):
-				try:
-					word_freq[word] += 1
-				except KeyError:
-					word_freq[word] = 1
-
-		return word_freq
+		words = messages.dropna().astype(str).str.upper().str.translate(self._strip_tbl).str.split().explode()
+		words = words[words.str.match(_RE_ALPHANUM.pattern, na=False)]
+		return words.value_counts().to_dict()
 	
 	def generate_cloud(self):
 		"""
@@ -376,12 +487,26 @@ class WordCloudGenerator:
 		print()
 		if len(self.word_data) > 0:
 			print(f"Generating {len(self.word_data)} WordCloud(s)")
-			for name, word_list in self.word_data.items():
-				print(f"\tGenerating WordCloud for {name}...", end='')
-				if self._generate_cloud_from_list(name, word_list):
-					print(" Complete")
-				else:
-					print(" Failed. An error ocurred while creating this WordCloud")
+
+			# Each person's WordCloud is independent, so we can generate them all in parallel
+			# Rendering is CPU bound, so this needs processes rather than threads
+			# Windows can't handle more than 61 worker processes
+			workers = min(len(self.word_data), os.cpu_count() or 1, 61)
+			jobs = {name: (word_list, self._output_file(name)) for name, word_list in self.word_data.items()}
+
+			if workers == 1:
+				# Not worth starting a pool (each worker re-imports this script) for a single process
+				_init_cloud_worker(self.mask_array, self.colour)
+				for name, job in jobs.items():
+					print(f"\tGenerating WordCloud for {name}...", end='')
+					self._print_cloud_result(_generate_cloud_from_list(*job))
+			else:
+				with ProcessPoolExecutor(max_workers=workers, initializer=_init_cloud_worker, initargs=(self.mask_array, self.colour)) as executor:
+					futures = {name: executor.submit(_generate_cloud_from_list, *job) for name, job in jobs.items()}
+
+					for name, future in futures.items():
+						print(f"\tGenerating WordCloud for {name}...", end='')
+						self._print_cloud_result(future.result())
 			
 			print()
 			print("Done. Your WordClouds can be found in the following directory:")
@@ -390,34 +515,27 @@ class WordCloudGenerator:
 			print("Nothing to do")
 		return True
 
-	def _generate_cloud_from_list(self, name, word_list):
+	def _print_cloud_result(self, result):
 		"""
-		Generates a WordCloud from a word_list
+		Finishes off the "Generating WordCloud for..." line with how it went
 		"""
-		plt.figure(figsize=[25,25], dpi=80)
-		plt.axis('off')
-		
-		if self.colour == "infer":
-			custom_colours = ImageColorGenerator(self.mask_array)
-			cloud = WordCloud(max_words=2000, mask=self.mask_array).fit_words(word_list)
-			plt.imshow(cloud.recolor(color_func=custom_colours), interpolation="bilinear")
+		if result:
+			print(" Complete")
 		else:
-			cloud = WordCloud(max_words=2000, mask=self.mask_array, colormap=self.colour)
-			cloud.fit_words(word_list)
-			plt.imshow(cloud, interpolation="bilinear")
-		
+			print(" Failed. An error ocurred while creating this WordCloud")
+
+	def _output_file(self, name):
+		"""
+		Returns the path that the WordCloud for the given name will be saved to
+		"""
 		colour_name = "custom_colour" if self.colour == "infer" else self.colour
-		output_file = self.output / f"wordcloud_{name}_{self.mask.stem}_{colour_name}.png"
-		plt.savefig(output_file, dpi=150, transparent=True)
-		
-		return True
+		return self.output / f"wordcloud_{name}_{self.mask.stem}_{colour_name}.png"
 
 	def display_mask(self):
 		"""
 		Displays how matplotlib will see the mask provided
 		"""
-		mask = np.array(Image.open(self.mask))
-		mask_image = Image.fromarray(mask, 'RGB')
+		mask_image = Image.fromarray(self.mask_array, 'RGB')
 		mask_image.show()
 
 